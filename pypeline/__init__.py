@@ -2,12 +2,17 @@ from .core import (
     Pipeline,
     Component,
     Map,
+    ThreadMap,
     Function,
     Source,
     Sink,
     Window,
     GroupBy,
     Flatten,
+    LookupJoin,
+    WindowJoin,
+    Union,
+    Merge,
     Filter,
 )
 
@@ -23,3 +28,13 @@ from .sink import (
     ListSink,
     DummySink,
 )
+
+from .sketch import (
+    Dedup,
+    DistinctCount,
+    TopK,
+    Quantiles,
+)
+
+from .utils import LRUCache
+from .pool import WorkerPool
@@ -1,40 +1,92 @@
 from abc import ABC, abstractmethod
+from collections.abc import Mapping
 from datetime import timedelta
-from collections import defaultdict
-from multiprocessing import Process
+from collections import defaultdict, deque
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import count
+from operator import itemgetter, attrgetter
+from multiprocessing import Process, SimpleQueue
+import os
+import time
 import uuid
 
-from .pipe import Pipe
-from .utils import to_datetime
+from .pipe import get_transport, recv_any
+from .store import MemoryStore, SpillStore
+from .utils import to_datetime, LRUCache
+
+# names pair a per-process uuid prefix with a counter, so that they are unique across processes
+# and runs without paying for a uuid per component
+name_prefix = uuid.uuid4().hex[:12]
+name_counter = count()
+
+
+def reset_names():
+    """ Give forked processes their own prefix instead of their parent's """
+    global name_prefix, name_counter
+    name_prefix = uuid.uuid4().hex[:12]
+    name_counter = count()
+
+
+# fork, and therefore register_at_fork, only exists on Unix
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_names)
+
+
+def unique_name():
+    return '{}-{}'.format(name_prefix, next(name_counter))
 
 
 class Component:
     def __init__(self):
+        self.inbound_pipes = []
         self.outbound_pipes = []
-        self.name = uuid.uuid4()
+        self.name = unique_name()
+
+    def __getstate__(self):
+        # the pipeline holds processes and pools which are not sent along with the component
+        state = self.__dict__.copy()
+        state.pop('pipeline', None)
+        return state
 
     def __or__(self, other):
         """ Add a child to this component """
         if not isinstance(other, Component):
             raise ValueError("{} should be a Component".format(other))
-        pipe = Pipe(self.name)
-        other.set_inbound_pipe(pipe)
-        self.outbound_pipes.append(pipe)
+        other.connect(self)
         self.pipeline.add_component(other)
         return other
 
+    def connect(self, parent):
+        """ Receive the rows of `parent` """
+        pipe = parent.pipeline.transport(parent.name)
+        self.add_inbound_pipe(pipe)
+        parent.outbound_pipes.append(pipe)
+
     def propagate(self, row):
         """ Apply operation on row and propagate results to children """
         res = self.apply(row)
         if res is not None:
             for r in res:
-                for pipe in self.outbound_pipes:
-                    pipe.send(r)
+                self.send(r)
+
+    def send(self, row):
+        """ Send a row to every child """
+        for pipe in self.outbound_pipes:
+            pipe.send(row)
 
     def apply(self, row):
         """ Operation of this component """
         yield row
 
+    def flush(self):
+        """ Rows still held by this component once its input is exhausted """
+        return ()
+
+    def stats(self):
+        """ Counters reported to the pipeline's `stats` once this component has run """
+        return {}
+
     def __matmul__(self, name):
         """ Set the name of this component """
         self.name = name
@@ -43,23 +95,38 @@ class Component:
     def set_pipeline(self, pipeline):
         self.pipeline = pipeline
 
-    def set_inbound_pipe(self, pipe):
-        self.inbound_pipe = pipe
+    def add_inbound_pipe(self, pipe):
+        self.inbound_pipes.append(pipe)
 
     def should_halt(self):
-        return self.inbound_pipe.is_closed()
+        """ Halt once every input is closed """
+        return all(pipe.is_closed() for pipe in self.inbound_pipes)
 
     def halt_children(self):
         """ Publish number of propagated rows so that children know when to stop """
+        for r in self.flush():
+            self.send(r)
         for pipe in self.outbound_pipes:
             pipe.close()
 
+    def recv(self):
+        """ Wait for rows on any open input and return them as (input index, row) """
+        open_pipes = [(i, pipe) for i, pipe in enumerate(self.inbound_pipes) if not pipe.is_closed()]
+        if not open_pipes:
+            return []
+        received = recv_any([pipe for _, pipe in open_pipes])
+        return [(open_pipes[i][0], row) for i, row in received]
+
+    def receive(self, index, row):
+        """ Handle a row received on input `index` """
+        self.propagate(row)
+
     def run(self):
-        """ Retrieve next row and propagate it """
+        """ Retrieve next rows and propagate them """
         while not self.should_halt():
-            row = self.inbound_pipe.recv()
-            if row is not None:
-                self.propagate(row)
+            for index, row in self.recv():
+                if row is not None:
+                    self.receive(index, row)
         self.halt_children()
 
 
@@ -79,6 +146,53 @@ class Map(Function):
         yield self.f(row)
 
 
+class ThreadMap(Map):
+    """ Map running a blocking `f` over a pool of threads
+
+    At most `pending` calls are in flight (twice the number of threads by default).
+    With `ordered=True` results are emitted in input order, otherwise as soon as they complete.
+    """
+    def __init__(self, f, threads=4, ordered=True, pending=None):
+        super().__init__(f)
+        if not (isinstance(threads, int) and threads > 0):
+            raise ValueError("threads should be a positive integer")
+        if pending is None:
+            pending = 2 * threads
+        if not (isinstance(pending, int) and pending > 0):
+            raise ValueError("pending should be a positive integer")
+        self.threads = threads
+        self.ordered = ordered
+        self.pending = pending
+        # the executor is created lazily so that threads are started in the component's process
+        self.executor = None
+        self.futures = deque()
+
+    def completed(self, block):
+        """ Pop finished futures, waiting for at least one if `block` """
+        if self.ordered:
+            while self.futures and (block or self.futures[0].done()):
+                yield self.futures.popleft().result()
+                block = False
+        else:
+            done, _ = wait(self.futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in [x for x in self.futures if x in done]:
+                self.futures.remove(future)
+                yield future.result()
+
+    def apply(self, row):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.futures.append(self.executor.submit(self.f, row))
+        yield from self.completed(block=len(self.futures) >= self.pending)
+
+    def flush(self):
+        while self.futures:
+            yield from self.completed(block=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
 class Filter(Function):
     def apply(self, row):
         if self.f(row):
@@ -108,35 +222,96 @@ class Sink(Component, ABC):
         pass
 
 
+def uses_items(field, row):
+    """ Whether `field` is read with row[field] rather than getattr(row, field) """
+    if isinstance(row, Mapping):
+        return True
+    try:
+        row[field]
+    except (KeyError, IndexError, TypeError):
+        return False
+    return True
+
+
+def field_getter(field, row):
+    """ Getter of `field` for rows of the same type as `row` """
+    if uses_items(field, row):
+        return itemgetter(field)
+    return attrgetter(field)
+
+
 class Key:
+    """ Value extracted from rows: a field (item or attribute), a callable, or a tuple of those
+
+    The getter is compiled for the type of the rows and compiled again when a row of another type
+    fails with it. Tuples give composite keys whose values are tuples.
+    """
     def __init__(self, key):
         self.key = key
-        if not (isinstance(key, str) or callable(key)):
-            raise ValueError("Key should be a str or a callable")
+        parts = key if isinstance(key, tuple) else (key,)
+        if not parts or not all(isinstance(k, (str, int)) or callable(k) for k in parts):
+            raise ValueError("Key should be a str, an int, a callable or a tuple of those")
+        self.getter = None
+        self.row_type = None
+
+    def __getstate__(self):
+        # compiled getters may be closures, they are compiled again after unpickling
+        state = self.__dict__.copy()
+        state['getter'] = state['row_type'] = None
+        return state
+
+    @property
+    def names(self):
+        """ Column name of each part of the key """
+        if not isinstance(self.key, tuple):
+            return [self.key if isinstance(self.key, str) else 'key']
+        return [k if isinstance(k, str) else 'key{}'.format(i) for i, k in enumerate(self.key)]
+
+    def compile(self, row):
+        if not isinstance(self.key, tuple):
+            return self.key if callable(self.key) else field_getter(self.key, row)
+        if len(self.key) > 1 and all(not callable(k) and uses_items(k, row) for k in self.key):
+            return itemgetter(*self.key)
+        getters = [k if callable(k) else field_getter(k, row) for k in self.key]
+        return lambda r: tuple(g(r) for g in getters)
 
     def get_value(self, row):
-        if isinstance(self.key, str):
-            try:
-                return row[self.key]
-            except:
-                return getattr(row, self.key)
-        elif callable(self.key):
-            return self.key(row)
+        try:
+            return self.getter(row)
+        except (KeyError, IndexError, TypeError, AttributeError):
+            # the getter is None before the first row, or was compiled for rows of another type
+            if type(row) is self.row_type:
+                raise
+        self.getter = self.compile(row)
+        self.row_type = type(row)
+        return self.getter(row)
 
 
 class Window(Component):
-    def __init__(self, window, *, key=None, skip=None):
+    """ Fixed or sliding window, based on a number of rows or on the time given by `key`
+
+    Rows of time-based windows are spilled to disk once they take more than `memory_budget` bytes,
+    in a temporary directory created in `spill_dir`. The budget bounds the rows kept between firings:
+    a fired window is still emitted as one list, so peak memory per firing is the size of the window.
+    """
+    def __init__(self, window, *, key=None, skip=None, memory_budget=None, spill_dir=None):
         super().__init__()
         if isinstance(window, int):
             self.window = window
+            if memory_budget is not None:
+                raise ValueError("memory_budget is only supported by time-based windows")
+            self.memory = []
         elif isinstance(window, timedelta):
             self.window = window
             if key is None:
                 raise ValueError("Should provide a key when using a time-based window")
             self.key = Key(key)
+            if memory_budget is None:
+                self.memory = MemoryStore()
+            else:
+                self.memory = SpillStore(memory_budget, spill_dir)
         else:
             raise ValueError("Window should be an integer or a timedelta")
-        self.memory = []
         if not (isinstance(skip, int) or skip is None):
             raise ValueError("Skip parameter should be None (for fixed windows) or an integer (for sliding windows)")
         self.skip = skip
@@ -147,7 +322,11 @@ class Window(Component):
         self.first_time = True
 
     def apply_row(self, row):
-        self.memory.append(row)
+        # time-based windows store each row with its timestamp
+        if isinstance(self.window, int):
+            self.memory.append(row)
+        else:
+            self.memory.append(to_datetime(self.key.get_value(row)), row)
         # if this is a time-based sliding window, we keep the first row timestamp
         # as the watermark to keep a track of rows to skip
         if self.first_time and isinstance(self.window, timedelta):
@@ -188,24 +367,14 @@ class Window(Component):
             while now - self.watermark >= self.window:
                 high_watermark = self.watermark + self.window
                 # retrieve all rows before the end of the current window
-                to_yield = []
-                for elem in self.memory:
-                    t = to_datetime(self.key.get_value(elem))
-                    if t < high_watermark:
-                        to_yield.append(elem)
-                yield to_yield
+                yield list(self.memory.rows_before(high_watermark))
                 # adjust watermark depending on window type (fixed/sliding)
                 if self.skip is None:
                     self.watermark += self.window
                 else:
                     self.watermark += timedelta(seconds=self.skip)
                 # keep only rows after the beginning of the next window
-                remaining = []
-                for elem in self.memory:
-                    t = to_datetime(self.key.get_value(elem))
-                    if t >= self.watermark:
-                        remaining.append(elem)
-                self.memory = remaining
+                self.memory.drop_before(self.watermark)
 
     def apply(self, data):
         if isinstance(data, list):
@@ -214,19 +383,320 @@ class Window(Component):
         else:
             yield from self.apply_row(data)
 
+    def halt_children(self):
+        if isinstance(self.window, timedelta):
+            self.memory.close()
+        super().halt_children()
+
+
+AGGREGATES = {
+    # name: (first state, update state with a value, result)
+    'count': (lambda v: 1, lambda s, v: s + 1, None),
+    'sum': (None, lambda s, v: s + v, None),
+    'min': (None, min, None),
+    'max': (None, max, None),
+    'mean': (lambda v: (v, 1), lambda s, v: (s[0] + v, s[1] + 1), lambda s: s[0] / s[1]),
+}
+
+
+def nested_values(grouped):
+    for value in grouped.values():
+        if isinstance(value, dict):
+            yield from nested_values(value)
+        else:
+            yield value
+
 
 class GroupBy(Component):
-    def __init__(self, key):
+    """ Split a list of rows by `key`, or aggregate each group in a single pass
+
+    With a tuple as `key`, groups are emitted in the same order as stacked GroupBys on each field.
+    `agg` maps output names to 'count', (field, name) where name is one of 'count', 'sum', 'mean',
+    'min' and 'max', or (field, f) where f reduces two values into one. Each group is then emitted
+    as a dict of its key fields and aggregates, and groups are never materialized.
+    """
+    def __init__(self, key, agg=None):
         super().__init__()
         self.key = Key(key)
+        self.agg = None
+        if agg is not None:
+            self.agg = [(name,) + self.aggregate(spec) for name, spec in agg.items()]
+
+    @staticmethod
+    def aggregate(spec):
+        if spec == 'count':
+            field, how = None, 'count'
+        elif isinstance(spec, tuple) and len(spec) == 2:
+            field, how = spec
+        else:
+            raise ValueError("Aggregate should be 'count' or a (field, aggregate) tuple")
+        if callable(how):
+            start, update, result = None, how, None
+        elif how in AGGREGATES:
+            start, update, result = AGGREGATES[how]
+        else:
+            raise ValueError("Aggregate should be a callable or one of {}".format(", ".join(AGGREGATES)))
+        return (None if field is None else Key(field), start, update, result)
 
     def apply(self, rows):
         if not isinstance(rows, list):
             raise ValueError("GroupBy must receive a list")
-        grouped = defaultdict(lambda: [])
+        if self.agg is not None:
+            yield from self.aggregate_groups(rows)
+        elif isinstance(self.key.key, tuple):
+            # nest one level per field so that groups come out as with stacked GroupBys
+            grouped = {}
+            for row in rows:
+                *path, last = self.key.get_value(row)
+                level = grouped
+                for k in path:
+                    level = level.setdefault(k, {})
+                level.setdefault(last, []).append(row)
+            yield from nested_values(grouped)
+        else:
+            grouped = defaultdict(lambda: [])
+            for row in rows:
+                grouped[self.key.get_value(row)].append(row)
+            yield from grouped.values()
+
+    def aggregate_groups(self, rows):
+        states = {}
         for row in rows:
-            grouped[self.key.get_value(row)].append(row)
-        yield from grouped.values()
+            k = self.key.get_value(row)
+            state = states.get(k)
+            if state is None:
+                state = states[k] = []
+                for _, field, start, _, _ in self.agg:
+                    v = None if field is None else field.get_value(row)
+                    state.append(v if start is None else start(v))
+            else:
+                for i, (_, field, _, update, _) in enumerate(self.agg):
+                    state[i] = update(state[i], None if field is None else field.get_value(row))
+        names = self.key.names
+        for k, state in states.items():
+            out = dict(zip(names, k if isinstance(self.key.key, tuple) else (k,)))
+            for (name, _, _, _, result), s in zip(self.agg, state):
+                out[name] = s if result is None else result(s)
+            yield out
+
+
+class LookupJoin(Component):
+    """ Enrich rows with reference data looked up by key
+
+    `loader` receives a list of keys and returns a mapping from key to fields; keys it does not return
+    have no match. Lookups go through `cache` (an LRUCache) and cache misses are buffered until `batch`
+    rows are waiting, so that the loader is called once per batch. `table` is an optional callable
+    returning the whole side table, loaded on the first row and kept apart from the cache; keys it does
+    not contain are given to the loader, or have no match without a loader.
+    Matched fields are merged into dict rows, other rows are emitted as (row, fields) tuples.
+    With `how='left'` rows without a match are emitted unchanged, with `how='inner'` they are dropped.
+    """
+    MISSING = object()
+
+    def __init__(self, key, loader=None, *, cache=None, table=None, batch=100, how='left'):
+        super().__init__()
+        if loader is None and table is None:
+            raise ValueError("Should provide a loader or a table")
+        if not (loader is None or callable(loader)):
+            raise TypeError("{} should be callable".format(loader))
+        if not (table is None or callable(table)):
+            raise TypeError("{} should be callable".format(table))
+        if how not in ('left', 'inner'):
+            raise ValueError("how should be 'left' or 'inner'")
+        if not (isinstance(batch, int) and batch > 0):
+            raise ValueError("batch should be a positive integer")
+        self.key = Key(key)
+        self.loader = loader
+        self.table = table
+        self.side = None
+        self.cache = LRUCache() if cache is None else cache
+        self.batch = batch
+        self.how = how
+        self.waiting = []
+        self.table_hits = 0
+        self.table_misses = 0
+
+    @property
+    def hits(self):
+        return self.cache.hits + self.table_hits
+
+    @property
+    def misses(self):
+        return self.cache.misses + self.table_misses
+
+    def load(self, keys):
+        """ Fetch `keys` with a single loader call and cache them, including those without a match """
+        found = self.loader(list(keys))
+        loaded = {}
+        for k in keys:
+            loaded[k] = found.get(k)
+            self.cache.put(k, loaded[k])
+        return loaded
+
+    def merge(self, row, fields):
+        if fields is None:
+            if self.how == 'left':
+                yield row
+        elif isinstance(row, Mapping) and isinstance(fields, Mapping):
+            yield {**row, **fields}
+        else:
+            yield (row, fields)
+
+    def resolve(self):
+        """ Load missing and stale keys in one call and emit the waiting rows """
+        keys = set(self.cache.to_refresh)
+        keys.update(k for k, _, fields in self.waiting if fields is self.MISSING)
+        loaded = self.load(keys) if keys else {}
+        for k, row, fields in self.waiting:
+            yield from self.merge(row, loaded[k] if fields is self.MISSING else fields)
+        self.waiting = []
+
+    def lookup(self, k):
+        """ Fields of `k` from the side table or the cache, MISSING if the loader must be asked """
+        if self.side is not None:
+            if k in self.side:
+                self.table_hits += 1
+                return self.side[k]
+            if self.loader is None:
+                self.table_misses += 1
+                return None
+        return self.cache.get(k, self.MISSING)
+
+    def apply(self, row):
+        if self.table is not None and self.side is None:
+            self.side = dict(self.table())
+        k = self.key.get_value(row)
+        fields = self.lookup(k)
+        # rows wait behind pending misses so that the output keeps the input order,
+        # along with the fields of cache hits since the next load may evict them
+        if fields is self.MISSING or self.waiting:
+            self.waiting.append((k, row, fields))
+            if len(self.waiting) >= self.batch:
+                yield from self.resolve()
+        else:
+            yield from self.merge(row, fields)
+        if len(self.cache.to_refresh) >= self.batch:
+            yield from self.resolve()
+
+    def flush(self):
+        yield from self.resolve()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class JoinBuffer:
+    """ Rows of one side of a WindowJoin, indexed by join key and by event time """
+    def __init__(self):
+        self.index = defaultdict(deque)
+        self.order = deque()
+        self.watermark = None
+
+    def add(self, k, t, row):
+        self.index[k].append((t, row))
+        self.order.append((t, k))
+        if self.watermark is None or t > self.watermark:
+            self.watermark = t
+
+    def evict(self, before):
+        """ Drop rows older than `before` """
+        while self.order and self.order[0][0] < before:
+            _, k = self.order.popleft()
+            rows = self.index[k]
+            rows.popleft()
+            if not rows:
+                del self.index[k]
+
+
+class WindowJoin(Component):
+    """ Join rows of two components having the same key and event times at most `within` apart
+
+    Emits (left_row, right_row) tuples as soon as both rows have been received.
+    Each side is expected to be ordered by event time: rows of one side are evicted once they are
+    older than the other side's latest event time minus `within`.
+    Event times are read from rows with the `time` key.
+    """
+    def __init__(self, left, right, key, within, *, time):
+        super().__init__()
+        for parent in (left, right):
+            if not isinstance(parent, Component):
+                raise ValueError("{} should be a Component".format(parent))
+        if not isinstance(within, timedelta):
+            raise ValueError("within should be a timedelta")
+        self.key = Key(key)
+        self.time = Key(time)
+        self.within = within
+        self.buffers = [JoinBuffer(), JoinBuffer()]
+        self.connect(left)
+        self.connect(right)
+        left.pipeline.add_component(self)
+
+    def add_inbound_pipe(self, pipe):
+        if len(self.inbound_pipes) == 2:
+            raise ValueError("The inputs of a WindowJoin are given to its constructor")
+        super().add_inbound_pipe(pipe)
+
+    def join(self, side, row):
+        k = self.key.get_value(row)
+        t = to_datetime(self.time.get_value(row))
+        mine, other = self.buffers[side], self.buffers[1 - side]
+        for t_other, row_other in other.index.get(k, ()):
+            if abs(t - t_other) <= self.within:
+                yield (row, row_other) if side == 0 else (row_other, row)
+        mine.add(k, t, row)
+        other.evict(mine.watermark - self.within)
+        if other.watermark is not None:
+            mine.evict(other.watermark - self.within)
+
+    def receive(self, side, row):
+        for r in self.join(side, row):
+            self.send(r)
+
+
+class Union(Component):
+    """ Propagate the rows of several components as they arrive
+
+    More inputs can be added with `component | union`.
+    """
+    def __init__(self, *parents):
+        super().__init__()
+        for parent in parents:
+            if not isinstance(parent, Component):
+                raise ValueError("{} should be a Component".format(parent))
+            self.connect(parent)
+        if parents:
+            parents[0].pipeline.add_component(self)
+
+
+class Merge(Union):
+    """ Propagate the rows of several components ordered by `key`
+
+    Each input is expected to be ordered by `key`. A row is propagated once every open input
+    has a row buffered, so that no smaller row can still arrive.
+    """
+    def __init__(self, *parents, key):
+        super().__init__(*parents)
+        self.key = Key(key)
+        self.heap = []
+        self.buffered = defaultdict(int)
+        self.counter = 0
+
+    def ready(self):
+        return all(self.buffered[i] > 0 or pipe.is_closed() for i, pipe in enumerate(self.inbound_pipes))
+
+    def receive(self, index, row):
+        # the counter keeps the heap stable and avoids comparing rows with equal keys
+        heapq.heappush(self.heap, (self.key.get_value(row), self.counter, index, row))
+        self.counter += 1
+        self.buffered[index] += 1
+        while self.heap and self.ready():
+            _, _, i, r = heapq.heappop(self.heap)
+            self.buffered[i] -= 1
+            self.send(r)
+
+    def flush(self):
+        while self.heap:
+            yield heapq.heappop(self.heap)[3]
 
 
 class Flatten(Component):
@@ -237,16 +707,29 @@ class Flatten(Component):
             raise ValueError("Flatten must receive a list")
 
 
-def run_component(component):
+def run_component(component, results):
     component.run()
+    results.put((component.name, component.stats()))
 
 
 class Pipeline:
-    def __init__(self, block=True):
+    """ Components run in their own process and exchange rows through pipes of the given `transport`
+
+    `transport` is 'multiprocessing' or 'redis'. When None, it is read from the PYPELINE_TRANSPORT
+    environment variable and defaults to 'multiprocessing'.
+    With a WorkerPool as `pool`, components run in the pool's processes instead of new ones.
+    Timings of the last run are kept in `stats`, along with the counters of each component
+    under stats['components'][name].
+    """
+    def __init__(self, block=True, transport=None, pool=None):
         self.block = block
+        self.transport = get_transport(transport)
+        self.pool = pool
         self.components = []
         self.processes = []
-        self.name = uuid.uuid4()
+        self.tasks = []
+        self.stats = {}
+        self.name = unique_name()
 
     def __or__(self, source):
         if not isinstance(source, Source):
@@ -255,18 +738,38 @@ class Pipeline:
         return source
 
     def add_component(self, component):
+        if component in self.components:
+            return
         component.set_pipeline(self)
         self.components.append(component)
 
     def run(self):
-        for compo in self.components:
-            p = Process(target=run_component, args=(compo,))
-            p.start()
-            self.processes.append(p)
+        start = time.perf_counter()
+        if self.pool is None:
+            self.results = SimpleQueue()
+            for compo in self.components:
+                p = Process(target=run_component, args=(compo, self.results))
+                p.start()
+                self.processes.append(p)
+        else:
+            self.tasks = self.pool.submit(self.components)
+        self.stats = {'startup': time.perf_counter() - start}
 
     def join(self):
         for p in self.processes:
             p.join()
+        if self.processes:
+            self.stats['components'] = {}
+            while not self.results.empty():
+                name, stats = self.results.get()
+                self.stats['components'][name] = stats
+            self.processes = []
+        if self.tasks:
+            self.stats['components'] = dict(zip(
+                (compo.name for compo in self.components),
+                self.pool.wait(self.tasks),
+            ))
+            self.tasks = []
 
     def __enter__(self):
         return self
@@ -1,79 +1,135 @@
+from multiprocessing import Pipe as mp_Pipe
+from multiprocessing.connection import wait
 import logging
+import os
+import pickle
 
 logger = logging.getLogger(__name__)
 
+# environment variables used when the transport is not given to the Pipeline
+TRANSPORT_ENV = 'PYPELINE_TRANSPORT'
+REDIS_URL_ENV = 'PYPELINE_REDIS_URL'
 
-def redis_available():
-    try:
-        import redis
-
-        # check that a redis server is available
-        r = redis.Redis()
-        r.get('test')
-        del r
-        return True
-    except:
-        return False
-
-if redis_available():
-    import pickle
+
+class Closed:
+    """ Sent through a multiprocessing pipe after its last row """
+
+
+class MultiprocessingPipe:
+    # the end of the pipe is signalled in-band rather than through shared memory
+    # so that pipes can be sent to processes that are already running
+    def __init__(self, name):
+        self.inbound, self.outbound = mp_Pipe(duplex=False)
+        self.closed = False
+
+    def send(self, value):
+        self.outbound.send(value)
+
+    def read(self):
+        value = self.inbound.recv()
+        if isinstance(value, Closed):
+            self.closed = True
+            return None
+        return value
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.outbound.send(Closed())
+
+    @staticmethod
+    def recv_any(pipes, timeout=0.05):
+        ready = wait([pipe.inbound for pipe in pipes], timeout)
+        received = []
+        for i, pipe in enumerate(pipes):
+            if pipe.inbound in ready:
+                row = pipe.read()
+                if not pipe.closed:
+                    received.append((i, row))
+        return received
+
+
+# connection pool of the current process, created on first use
+redis_pool = None
+redis_pool_pid = None
+
+
+def redis_client():
+    """ Redis client sharing the connection pool of the current process """
+    global redis_pool, redis_pool_pid
     import redis
 
-    class Pipe:
-        def __init__(self, name):
-            self.message_key = 'pypeline.messages.%s' % name
-            self.total_key = 'pypeline.totals.%s' % name
-            self.redis = redis.Redis()
-            self.in_counter = 0
-            self.out_counter = 0
-
-        def send(self, value):
-            self.redis.rpush(self.message_key, pickle.dumps(value))
-            self.out_counter += 1
-
-        def recv(self):
-            value = self.redis.lpop(self.message_key)
-            if value is not None:
-                value = pickle.loads(value)
-                self.in_counter += 1
-            return value
-
-        def is_closed(self):
-            total = self.redis.get(self.total_key)
-            if total is None:
-                return False
-            total = int(total)
-            return total == self.in_counter
-
-        def close(self):
-            self.redis.set(self.total_key, self.out_counter)
-
-else:
-    from multiprocessing import Pipe as mp_Pipe, Value
-
-    logging.info("Using multiprocessing backend")
-
-    class Pipe:
-        def __init__(self, name):
-            self.inbound, self.outbound = mp_Pipe(duplex=False)
-            self.total = Value('i', -1)
-            self.in_counter = 0
-            self.out_counter = 0
-
-        def send(self, value):
-            self.outbound.send(value)
-            self.out_counter += 1
-
-        def recv(self):
-            if self.inbound.poll():
-                self.in_counter += 1
-                return self.inbound.recv()
-
-        def is_closed(self):
-            if self.total.value == -1:
-                return False
-            else:
-                return self.total.value == self.in_counter
-
-        def close(self):
-            self.total.value = self.out_counter
+    if redis_pool_pid != os.getpid():
+        # a pool inherited through fork must not be reused
+        redis_pool = redis.ConnectionPool.from_url(os.environ.get(REDIS_URL_ENV, 'redis://localhost:6379'))
+        redis_pool_pid = os.getpid()
+    return redis.Redis(connection_pool=redis_pool)
+
+
+class RedisPipe:
+    def __init__(self, name):
+        self.message_key = 'pypeline.messages.%s' % name
+        self.total_key = 'pypeline.totals.%s' % name
+        self.client = None
+        self.client_pid = None
+        self.in_counter = 0
+        self.out_counter = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['client'] = state['client_pid'] = None
+        return state
+
+    @property
+    def redis(self):
+        if self.client_pid != os.getpid():
+            self.client = redis_client()
+            self.client_pid = os.getpid()
+        return self.client
+
+    def send(self, value):
+        self.redis.rpush(self.message_key, pickle.dumps(value))
+        self.out_counter += 1
+
+    def is_closed(self):
+        total = self.redis.get(self.total_key)
+        if total is None:
+            return False
+        total = int(total)
+        return total == self.in_counter
+
+    def close(self):
+        self.redis.set(self.total_key, self.out_counter)
+
+    @staticmethod
+    def recv_any(pipes, timeout=0.05):
+        keys = {pipe.message_key: i for i, pipe in enumerate(pipes)}
+        popped = pipes[0].redis.blpop(list(keys), timeout)
+        if popped is None:
+            return []
+        key, value = popped
+        i = keys[key.decode()]
+        pipes[i].in_counter += 1
+        return [(i, pickle.loads(value))]
+
+
+TRANSPORTS = {
+    'multiprocessing': MultiprocessingPipe,
+    'redis': RedisPipe,
+}
+
+
+def get_transport(transport=None):
+    """ Pipe class of `transport`, read from PYPELINE_TRANSPORT when None (multiprocessing by default) """
+    if transport is None:
+        transport = os.environ.get(TRANSPORT_ENV, 'multiprocessing')
+    try:
+        return TRANSPORTS[transport]
+    except KeyError:
+        raise ValueError("Transport should be one of {}".format(", ".join(TRANSPORTS)))
+
+
+def recv_any(pipes, timeout=0.05):
+    """ Wait until one of `pipes` has a row and return a list of (index, row) """
+    return type(pipes[0]).recv_any(pipes, timeout)
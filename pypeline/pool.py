@@ -0,0 +1,86 @@
+from collections import deque
+from multiprocessing.reduction import ForkingPickler
+import multiprocessing
+import time
+
+
+def work(connection):
+    """ Run the components received on `connection` until None is received """
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        payload, submitted_at = task
+        started_at = time.time()
+        try:
+            component = ForkingPickler.loads(payload)
+            component.run()
+        except Exception as e:
+            connection.send(e)
+        else:
+            stats = {'delay': started_at - submitted_at, 'duration': time.time() - started_at}
+            connection.send({**stats, **component.stats()})
+
+
+class WorkerPool:
+    """ Long-lived processes running the components of successive pipelines
+
+    Every component of a pipeline runs at the same time, so the pool starts new workers when it
+    has fewer idle workers than components. With the forkserver context, workers are forked from
+    a server which imported pypeline and the `preload` modules once.
+    Components are pickled to be sent to the workers: their functions should be importable,
+    lambdas are not supported.
+    """
+    def __init__(self, processes=0, *, preload=(), context='forkserver'):
+        self.context = multiprocessing.get_context(context)
+        if context == 'forkserver':
+            self.context.set_forkserver_preload(['pypeline', *preload])
+        self.workers = []
+        self.idle = deque()
+        for _ in range(processes):
+            self.idle.append(self.start_worker())
+
+    def start_worker(self):
+        connection, child_connection = self.context.Pipe()
+        process = self.context.Process(target=work, args=(child_connection,), daemon=True)
+        process.start()
+        child_connection.close()
+        self.workers.append((process, connection))
+        return connection
+
+    def submit(self, components):
+        """ Start running `components` and return the connections to wait on """
+        # pickle every component first so that none of them runs if one cannot be sent
+        payloads = [bytes(ForkingPickler.dumps(component)) for component in components]
+        tasks = []
+        for payload in payloads:
+            connection = self.idle.popleft() if self.idle else self.start_worker()
+            connection.send((payload, time.time()))
+            tasks.append(connection)
+        return tasks
+
+    def wait(self, tasks):
+        """ Wait for submitted components and return their timings """
+        results = []
+        for connection in tasks:
+            results.append(connection.recv())
+            self.idle.append(connection)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def close(self):
+        for process, connection in self.workers:
+            connection.send(None)
+        for process, connection in self.workers:
+            process.join()
+            connection.close()
+        self.workers = []
+        self.idle.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,445 @@
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Mapping
+from copy import deepcopy
+from datetime import timedelta
+from hashlib import blake2b
+import math
+import random
+
+from .core import Component, Key
+from .utils import to_datetime
+
+
+def tagged(tag, payload):
+    return tag + str(len(payload)).encode() + b':' + payload
+
+
+def encode(value):
+    """ Canonical bytes of `value`, tagged with its type
+
+    Mappings and sets are encoded with their entries sorted, so that equal values give the same
+    bytes whatever their insertion order or the hash seed of the process.
+    """
+    if value is None:
+        return b'N'
+    if isinstance(value, bool):
+        return b'B1' if value else b'B0'
+    if isinstance(value, int):
+        return tagged(b'I', str(value).encode())
+    if isinstance(value, float):
+        return tagged(b'F', value.hex().encode())
+    if isinstance(value, str):
+        return tagged(b'S', value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return tagged(b'Y', bytes(value))
+    if isinstance(value, (tuple, list)):
+        return tagged(b'T' if isinstance(value, tuple) else b'L', b''.join(map(encode, value)))
+    if isinstance(value, Mapping):
+        return tagged(b'M', b''.join(sorted(encode(k) + encode(v) for k, v in value.items())))
+    if isinstance(value, (set, frozenset)):
+        return tagged(b'E', b''.join(sorted(map(encode, value))))
+    return tagged(b'R', '{}:{!r}'.format(type(value).__qualname__, value).encode())
+
+
+def hash128(value):
+    """ Hash that is stable across processes, unlike `hash` on str """
+    h = int.from_bytes(blake2b(encode(value), digest_size=16).digest(), 'little')
+    return h & 0xFFFFFFFFFFFFFFFF, h >> 64
+
+
+def check_mergeable(sketch, other, *attributes):
+    if type(sketch) is not type(other) or any(getattr(sketch, a) != getattr(other, a) for a in attributes):
+        raise ValueError("Can only merge sketches built with the same parameters")
+
+
+class BloomFilter:
+    """ Set membership with a false positive rate of `error` up to `capacity` values """
+    def __init__(self, capacity=10000, error=0.01):
+        if not (isinstance(capacity, int) and capacity > 0):
+            raise ValueError("capacity should be a positive integer")
+        if not 0 < error < 1:
+            raise ValueError("error should be between 0 and 1")
+        self.size = math.ceil(-capacity * math.log(error) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value):
+        h1, h2 = hash128(value)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        """ Add `value` and return whether it was (probably) already present """
+        present = True
+        for p in self.positions(value):
+            byte, bit = divmod(p, 8)
+            if not self.bits[byte] & (1 << bit):
+                present = False
+                self.bits[byte] |= 1 << bit
+        return present
+
+    def __contains__(self, value):
+        return all(self.bits[p // 8] & (1 << (p % 8)) for p in self.positions(value))
+
+    def merge(self, other):
+        check_mergeable(self, other, 'size', 'hashes')
+        self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+        return self
+
+
+class HyperLogLog:
+    """ Number of distinct values with a relative standard error of about `error` """
+    def __init__(self, error=0.02):
+        if not 0 < error < 1:
+            raise ValueError("error should be between 0 and 1")
+        self.precision = min(16, max(4, math.ceil(math.log2((1.04 / error) ** 2))))
+        self.registers = bytearray(1 << self.precision)
+
+    def add(self, value):
+        h, _ = hash128(value)
+        width = 64 - self.precision
+        i = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def merge(self, other):
+        check_mergeable(self, other, 'precision')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+
+class CountMinSketch:
+    """ Frequencies overestimated by at most `error` times the total count, with probability `confidence` """
+    def __init__(self, error=0.01, confidence=0.99):
+        if not (0 < error < 1 and 0 < confidence < 1):
+            raise ValueError("error and confidence should be between 0 and 1")
+        self.width = math.ceil(math.e / error)
+        self.depth = math.ceil(math.log(1 / (1 - confidence)))
+        self.tables = [array('Q', bytes(8 * self.width)) for _ in range(self.depth)]
+
+    def columns(self, value):
+        h1, h2 = hash128(value)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, value, count=1):
+        for table, c in zip(self.tables, self.columns(value)):
+            table[c] += count
+
+    def estimate(self, value):
+        return min(table[c] for table, c in zip(self.tables, self.columns(value)))
+
+    def merge(self, other):
+        check_mergeable(self, other, 'width', 'depth')
+        for table, other_table in zip(self.tables, other.tables):
+            for c, n in enumerate(other_table):
+                table[c] += n
+        return self
+
+
+class TopKSketch:
+    """ Most frequent values, tracked with Space-Saving counters and bounded by a Count-Min sketch """
+    def __init__(self, k=10, error=0.01, confidence=0.99, capacity=None):
+        if not (isinstance(k, int) and k > 0):
+            raise ValueError("k should be a positive integer")
+        self.k = k
+        self.capacity = 4 * k if capacity is None else capacity
+        if self.capacity < k:
+            raise ValueError("capacity should be at least k")
+        self.frequencies = CountMinSketch(error, confidence)
+        self.counters = {}
+
+    def add(self, value):
+        self.frequencies.add(value)
+        if value in self.counters:
+            self.counters[value] += 1
+        elif len(self.counters) < self.capacity:
+            self.counters[value] = 1
+        else:
+            # Space-Saving: the new value replaces the least frequent one and inherits its count
+            smallest = min(self.counters, key=self.counters.get)
+            self.counters[value] = self.counters.pop(smallest) + 1
+
+    def top(self):
+        """ The k most frequent values as (value, estimated count) """
+        counts = [(v, min(n, self.frequencies.estimate(v))) for v, n in self.counters.items()]
+        counts.sort(key=lambda c: c[1], reverse=True)
+        return counts[:self.k]
+
+    def merge(self, other):
+        check_mergeable(self, other, 'k', 'capacity')
+        self.frequencies.merge(other.frequencies)
+        for v, n in other.counters.items():
+            self.counters[v] = self.counters.get(v, 0) + n
+        largest = sorted(self.counters.items(), key=lambda c: c[1], reverse=True)[:self.capacity]
+        self.counters = dict(largest)
+        return self
+
+
+class KLLSketch:
+    """ Quantiles with a rank error decreasing with `k` (about 1.7% for k=200) """
+    def __init__(self, k=200, seed=None):
+        if not (isinstance(k, int) and k >= 8):
+            raise ValueError("k should be an integer of at least 8")
+        self.k = k
+        self.compactors = [[]]
+        self.random = random.Random(seed)
+
+    def capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.compress()
+
+    def compress(self):
+        while sum(map(len, self.compactors)) > sum(map(self.capacity, range(len(self.compactors)))):
+            for level, items in enumerate(self.compactors):
+                if len(items) >= self.capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    items.sort()
+                    # an odd item out stays at this level
+                    kept = [items.pop()] if len(items) % 2 else []
+                    self.compactors[level + 1].extend(items[self.random.randint(0, 1)::2])
+                    self.compactors[level] = kept
+                    break
+
+    def quantile(self, q):
+        weighted = sorted((v, 1 << level) for level, items in enumerate(self.compactors) for v in items)
+        if not weighted:
+            return None
+        target = q * sum(w for _, w in weighted)
+        seen = 0
+        for v, w in weighted:
+            seen += w
+            if seen >= target:
+                return v
+        return weighted[-1][0]
+
+    def merge(self, other):
+        check_mergeable(self, other, 'k')
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.compress()
+        return self
+
+
+class SketchComponent(Component, ABC):
+    """ Summarize each list of rows received, per value of `by` if given
+
+    Emits the estimate for the list, or a dict from each value of `by` to its estimate.
+    With `sketch=True` the sketches themselves are emitted so that they can be merged downstream.
+    """
+    def __init__(self, key, *, by=None, sketch=False):
+        super().__init__()
+        self.key = Key(key)
+        self.by = None if by is None else Key(by)
+        self.emit_sketch = sketch
+
+    @abstractmethod
+    def new_sketch(self):
+        pass
+
+    @abstractmethod
+    def estimate(self, sketch):
+        pass
+
+    def result(self, sketch):
+        return sketch if self.emit_sketch else self.estimate(sketch)
+
+    def apply(self, rows):
+        if not isinstance(rows, list):
+            raise ValueError("{} must receive a list".format(type(self).__name__))
+        if self.by is None:
+            sketch = self.new_sketch()
+            for row in rows:
+                sketch.add(self.key.get_value(row))
+            yield self.result(sketch)
+        else:
+            sketches = {}
+            for row in rows:
+                group = self.by.get_value(row)
+                sketch = sketches.get(group)
+                if sketch is None:
+                    sketch = sketches[group] = self.new_sketch()
+                sketch.add(self.key.get_value(row))
+            yield {group: self.result(sketch) for group, sketch in sketches.items()}
+
+
+class DistinctCount(SketchComponent):
+    """ Number of distinct values of `key`, using a HyperLogLog """
+    def __init__(self, key, *, error=0.02, by=None, sketch=False):
+        super().__init__(key, by=by, sketch=sketch)
+        self.error = error
+
+    def new_sketch(self):
+        return HyperLogLog(self.error)
+
+    def estimate(self, sketch):
+        return sketch.count()
+
+
+class TopK(SketchComponent):
+    """ `k` most frequent values of `key` with their estimated count """
+    def __init__(self, k, key, *, error=0.01, confidence=0.99, capacity=None, by=None, sketch=False):
+        super().__init__(key, by=by, sketch=sketch)
+        self.k = k
+        self.error = error
+        self.confidence = confidence
+        self.capacity = capacity
+
+    def new_sketch(self):
+        return TopKSketch(self.k, self.error, self.confidence, self.capacity)
+
+    def estimate(self, sketch):
+        return sketch.top()
+
+
+class Quantiles(SketchComponent):
+    """ Dict from each of `quantiles` to the estimated value of `key`, using a KLL sketch """
+    def __init__(self, key, quantiles=(0.5, 0.9, 0.99), *, k=200, by=None, sketch=False):
+        super().__init__(key, by=by, sketch=sketch)
+        self.quantiles = quantiles
+        self.k = k
+
+    def new_sketch(self):
+        return KLLSketch(self.k)
+
+    def estimate(self, sketch):
+        return {q: sketch.quantile(q) for q in self.quantiles}
+
+
+class RotatingBloomFilter:
+    """ Two Bloom filters of `capacity` values, the older one being dropped on rotation
+
+    The filters are rotated whenever the newer one holds `capacity` values, so that the false
+    positive rate stays below `error`. Values are remembered for at least `capacity` insertions.
+    """
+    def __init__(self, capacity, error, start=0):
+        self.capacity = capacity
+        self.error = error
+        self.current = BloomFilter(capacity, error)
+        self.previous = None
+        self.rotate(start)
+
+    def rotate(self, start):
+        self.previous = self.current
+        self.current = BloomFilter(self.capacity, self.error)
+        self.start = start
+        self.inserted = 0
+
+    def add(self, value):
+        """ Add `value` and return whether it was (probably) already seen """
+        if self.current.add(value):
+            return True
+        self.inserted += 1
+        seen = value in self.previous
+        if self.inserted >= self.capacity:
+            self.rotate(self.start)
+        return seen
+
+    def merge(self, other):
+        """ Merge the filters of `other` pairwise, keeping the latest start """
+        check_mergeable(self, other, 'capacity', 'error')
+        self.current.merge(other.current)
+        self.previous.merge(other.previous)
+        self.start = max(self.start, other.start)
+        # an upper bound, since both sides may have inserted the same values
+        self.inserted += other.inserted
+        if self.inserted >= self.capacity:
+            self.rotate(self.start)
+        return self
+
+
+class Dedup(Component):
+    """ Drop rows whose `key` was already seen, with a false positive rate of `error`
+
+    Lists of rows are deduplicated on their own. Single rows are deduplicated against the rows seen
+    within the last `within` rows (an int) or event time (a timedelta, read from `time`), using two
+    Bloom filters which are rotated every `within`. Rows are therefore remembered for between one
+    and two times `within`. Filters are also rotated once they hold `capacity` values, so at high
+    cardinality rows are only remembered for the last `capacity` distinct values at least.
+    With `by`, each value of `by` has its own filters.
+
+    The filters, a dict from each value of `by` (None without `by`) to a RotatingBloomFilter, can be
+    given with `filters` and are emitted after the last row with `sketch=True`, so that the state of
+    parallel replicas can be combined with `merge`.
+    """
+    def __init__(self, key=None, *, within=None, time=None, by=None, capacity=10000, error=0.01,
+                 filters=None, sketch=False):
+        super().__init__()
+        if isinstance(within, timedelta):
+            if time is None:
+                raise ValueError("Should provide a time key when within is a timedelta")
+            self.time = Key(time)
+        elif not (within is None or isinstance(within, int)):
+            raise ValueError("within should be None, an integer or a timedelta")
+        self.key = None if key is None else Key(key)
+        self.by = None if by is None else Key(by)
+        self.within = within
+        self.capacity = capacity
+        self.error = error
+        # per value of `by`, with the start of the current filter in event time or in rows
+        self.filters = {}
+        self.emit_sketch = sketch
+        if filters is not None:
+            self.merge(filters)
+
+    def merge(self, filters):
+        """ Merge the filters of another Dedup into this one """
+        for group, other in filters.items():
+            if group in self.filters:
+                self.filters[group].merge(other)
+            else:
+                self.filters[group] = deepcopy(other)
+        return self
+
+    def value(self, row):
+        return row if self.key is None else self.key.get_value(row)
+
+    def seen(self, row):
+        group = None if self.by is None else self.by.get_value(row)
+        filters = self.filters.get(group)
+        if isinstance(self.within, timedelta):
+            start = to_datetime(self.time.get_value(row))
+        else:
+            start = 0
+        if filters is None:
+            filters = self.filters[group] = RotatingBloomFilter(self.capacity, self.error, start)
+        elif isinstance(self.within, timedelta):
+            if start - filters.start >= 2 * self.within:
+                # after a gap, the previous filter is too old as well
+                filters.rotate(start)
+                filters.rotate(start)
+            elif start - filters.start >= self.within:
+                filters.rotate(start)
+        elif self.within is not None:
+            filters.start += 1
+            if filters.start >= self.within:
+                filters.rotate(0)
+        return filters.add(self.value(row))
+
+    def apply(self, data):
+        if isinstance(data, list):
+            filters = RotatingBloomFilter(self.capacity, self.error)
+            yield [row for row in data if not filters.add(self.value(row))]
+        elif not self.seen(data):
+            yield data
+
+    def flush(self):
+        if self.emit_sketch:
+            yield self.filters
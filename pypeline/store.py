@@ -0,0 +1,121 @@
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+
+
+class MemoryStore:
+    """ Rows of a time-based window with their timestamp, kept in memory """
+    def __init__(self):
+        self.rows = []
+
+    def append(self, t, row):
+        self.rows.append((t, row))
+
+    def rows_before(self, end):
+        for t, row in self.rows:
+            if t < end:
+                yield row
+
+    def drop_before(self, start):
+        self.rows = [(t, row) for t, row in self.rows if t >= start]
+
+    def close(self):
+        self.rows = []
+
+
+class Segment:
+    """ Append-only file of pickled (timestamp, row) tuples """
+    def __init__(self, path, records):
+        self.path = path
+        self.offsets = [0]
+        self.start = min(t for t, _ in records)
+        self.end = max(t for t, _ in records)
+        with open(path, 'wb') as f:
+            for _, data in records:
+                f.write(data)
+                self.offsets.append(self.offsets[-1] + len(data))
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for a, b in zip(self.offsets, self.offsets[1:]):
+                yield pickle.loads(m[a:b])
+
+    def remove(self):
+        os.unlink(self.path)
+
+
+class SpillStore(MemoryStore):
+    """ Rows of a time-based window, spilled to segment files once they exceed `budget` bytes in memory
+
+    Recent rows are kept pickled in memory. When they take more than `budget` bytes, the oldest of
+    them are written to a new segment file in a temporary directory created in `directory`, until
+    the rows left in memory take at most half the budget. Segments are deleted once all their rows
+    are older than the start of the window.
+    """
+    def __init__(self, budget, directory=None):
+        if not (isinstance(budget, int) and budget > 0):
+            raise ValueError("budget should be a positive number of bytes")
+        super().__init__()
+        self.budget = budget
+        self.directory = directory
+        self.path = None
+        self.size = 0
+        self.segments = []
+        self.spilled = 0
+        self.start = None
+
+    def append(self, t, row):
+        data = pickle.dumps((t, row))
+        self.rows.append((t, data))
+        self.size += len(data)
+        if self.size > self.budget:
+            self.spill()
+
+    def spill(self):
+        if self.path is None:
+            self.path = tempfile.mkdtemp(prefix='pypeline-', dir=self.directory)
+        # keep the newest rows in memory, up to half the budget so that segments are not tiny
+        kept = 0
+        split = len(self.rows)
+        while split > 0 and kept + len(self.rows[split - 1][1]) <= self.budget // 2:
+            split -= 1
+            kept += len(self.rows[split][1])
+        path = os.path.join(self.path, '%d.segment' % self.spilled)
+        self.segments.append(Segment(path, self.rows[:split]))
+        self.spilled += 1
+        self.rows = self.rows[split:]
+        self.size = kept
+
+    def rows_before(self, end):
+        """ Stream the rows older than `end`, from the segments first """
+        for segment in self.segments:
+            if segment.start >= end:
+                continue
+            for t, row in segment:
+                if t < end and (self.start is None or t >= self.start):
+                    yield row
+        for t, data in self.rows:
+            if t < end:
+                yield pickle.loads(data)[1]
+
+    def drop_before(self, start):
+        self.start = start
+        remaining = []
+        for segment in self.segments:
+            if segment.end < start:
+                segment.remove()
+            else:
+                remaining.append(segment)
+        self.segments = remaining
+        self.rows = [(t, data) for t, data in self.rows if t >= start]
+        self.size = sum(len(data) for _, data in self.rows)
+
+    def close(self):
+        super().close()
+        self.segments = []
+        self.size = 0
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
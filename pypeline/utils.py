@@ -1,4 +1,6 @@
+from collections import OrderedDict
 from datetime import datetime
+import time
 
 from dateutil.parser import parse as date_parse
 
@@ -12,3 +14,65 @@ def to_datetime(d):
         return d
     else:
         raise ValueError("{} should be a datetime".format(d))
+
+
+class LRUCache:
+    """ Bounded least-recently-used cache
+
+    Entries older than `ttl` seconds are treated as missing.
+    With `refresh_ahead` (a fraction of `ttl`), entries older than `refresh_ahead * ttl` are still
+    returned but their key is added to `to_refresh` so that the caller can reload them in bulk.
+    """
+    def __init__(self, maxsize=10000, ttl=None, refresh_ahead=None, clock=time.monotonic):
+        if not (isinstance(maxsize, int) and maxsize > 0):
+            raise ValueError("maxsize should be a positive integer")
+        if refresh_ahead is not None:
+            if ttl is None:
+                raise ValueError("refresh_ahead requires a ttl")
+            if not 0 < refresh_ahead < 1:
+                raise ValueError("refresh_ahead should be between 0 and 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.to_refresh = set()
+        self.hits = 0
+        self.misses = 0
+
+    def expired(self, loaded_at):
+        return self.ttl is not None and self.clock() - loaded_at >= self.ttl
+
+    def get(self, key, default=None):
+        """ Return the cached value, counting a hit or a miss """
+        try:
+            value, loaded_at = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if self.expired(loaded_at):
+            del self.entries[key]
+            self.misses += 1
+            return default
+        if self.refresh_ahead is not None and self.clock() - loaded_at >= self.refresh_ahead * self.ttl:
+            self.to_refresh.add(key)
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        try:
+            _, loaded_at = self.entries[key]
+        except KeyError:
+            return False
+        return not self.expired(loaded_at)
+
+    def put(self, key, value):
+        self.entries[key] = (value, self.clock())
+        self.entries.move_to_end(key)
+        self.to_refresh.discard(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,10 +1,18 @@
 from datetime import datetime, timedelta
 import random
 from copy import deepcopy
+from multiprocessing import Manager
 
 import pytest
 
 
+@pytest.fixture
+def shared_list():
+    """ List that sinks running in another process can append to """
+    with Manager() as manager:
+        yield manager.list()
+
+
 @pytest.fixture
 def data_list():
     return list(range(15))
@@ -1,5 +1,16 @@
+from collections import namedtuple
 from datetime import datetime, timedelta
+from functools import reduce
+from multiprocessing import Process
 import os
+import pickle
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
 
 from pypeline import (
     Pipeline,
@@ -12,7 +23,21 @@ from pypeline import (
     Window,
     GroupBy,
     Flatten,
+    ThreadMap,
+    LookupJoin,
+    LRUCache,
+    WindowJoin,
+    Union,
+    Merge,
+    Map,
+    WorkerPool,
+    Dedup,
+    DistinctCount,
+    TopK,
+    Quantiles,
 )
+from pypeline.core import Key
+from pypeline.pipe import MultiprocessingPipe, RedisPipe
 
 from .fixtures import *
 
@@ -312,4 +337,382 @@ def test_window_not_aligned(data_timed_not_aligned):
         [3, 4, 6, 7],
         [12, 13, 14, 15, 16, 17],
         [22, 23, 24, 25, 27],
-    ])
\ No newline at end of file
+    ])
+
+def slow_square(x):
+    time.sleep(0.01 * (x % 3))
+    return x * x
+
+
+def test_threadmap_ordered(data_list, shared_list):
+    with Pipeline() as p:
+        p | IterableSource(data_list) | ThreadMap(slow_square, threads=4) | ListSink(shared_list)
+
+    assert(list(shared_list) == [x * x for x in data_list])
+
+
+def test_threadmap_unordered(data_list, shared_list):
+    with Pipeline() as p:
+        p | IterableSource(data_list) | ThreadMap(slow_square, threads=4, ordered=False) | ListSink(shared_list)
+
+    assert(sorted(shared_list) == [x * x for x in data_list])
+
+
+def test_lookup_join_batches_misses():
+    calls = []
+
+    def loader(keys):
+        calls.append(sorted(keys))
+        return {k: {'name': 'device-%d' % k} for k in keys if k != 3}
+
+    join = LookupJoin('device', loader, batch=4)
+    rows = [{'device': i % 5, 'value': i} for i in range(12)]
+    result = [r for row in rows for r in join.apply(row)]
+    result += list(join.flush())
+
+    assert(calls == [[0, 1, 2, 3], [4]])
+    assert([r['value'] for r in result] == list(range(12)))
+    assert([r.get('name') for r in result[:5]] == ['device-0', 'device-1', 'device-2', None, 'device-4'])
+    assert((join.hits, join.misses) == (7, 5))
+
+
+def test_lookup_join_ttl_refresh_ahead():
+    now = [0]
+    calls = []
+
+    def loader(keys):
+        calls.append(sorted(keys))
+        return {k: {'version': now[0]} for k in keys}
+
+    cache = LRUCache(maxsize=2, ttl=10, refresh_ahead=0.5, clock=lambda: now[0])
+    join = LookupJoin('k', loader, cache=cache, batch=1, how='inner')
+
+    assert(list(join.apply({'k': 'a'})) == [{'k': 'a', 'version': 0}])
+    now[0] = 6
+    # stale but not expired: served from the cache, then refreshed
+    assert(list(join.apply({'k': 'a'})) == [{'k': 'a', 'version': 0}])
+    assert(calls == [['a'], ['a']])
+    now[0] = 20
+    assert(list(join.apply({'k': 'a'})) == [{'k': 'a', 'version': 20}])
+    for k in 'bc':
+        list(join.apply({'k': k}))
+    assert(len(cache) == 2 and 'a' not in cache)
+
+
+def test_window_join(shared_list):
+    start = datetime(2018, 5, 4, 15, 45)
+    impressions = [{'ad': i % 3, 'time': start + timedelta(seconds=i), 'imp': i} for i in range(10)]
+    clicks = [{'ad': i % 3, 'time': start + timedelta(seconds=i + 1), 'click': i} for i in range(0, 10, 4)]
+
+    with Pipeline() as p:
+        left = p | IterableSource(impressions)
+        right = p | IterableSource(clicks)
+        WindowJoin(left, right, 'ad', timedelta(seconds=1), time='time') | ListSink(shared_list)
+
+    result = sorted((l['imp'], r['click']) for l, r in shared_list)
+
+    assert(result == [(0, 0), (4, 4), (8, 8)])
+
+
+def test_window_join_evicts():
+    start = datetime(2018, 5, 4, 15, 45)
+    p = Pipeline()
+    join = WindowJoin(p | DummySource(), p | DummySource(), 'k', timedelta(seconds=5), time='t')
+    for i in range(100):
+        row = {'k': 0, 't': start + timedelta(seconds=i)}
+        assert(len(list(join.join(i % 2, row))) == min(3, (i + 1) // 2))
+
+    assert(all(len(b.order) <= 4 for b in join.buffers))
+
+
+def test_union(data_list, shared_list):
+    with Pipeline() as p:
+        union = Union(p | IterableSource(data_list), p | IterableSource(data_list[:5]))
+        p | IterableSource(['a', 'b']) | union
+        union | ListSink(shared_list)
+
+    assert(sorted(shared_list, key=str) == sorted(data_list + data_list[:5] + ['a', 'b'], key=str))
+
+
+def test_merge(data_timed_holes, shared_list):
+    even = [row for row in data_timed_holes if row['value'] % 2 == 0]
+    odd = [row for row in data_timed_holes if row['value'] % 2 == 1]
+
+    with Pipeline() as p:
+        Merge(p | IterableSource(even), p | IterableSource(odd), key='time') | ListSink(shared_list)
+
+    assert([row['value'] for row in shared_list] == [row['value'] for row in data_timed_holes])
+
+
+def test_transport(monkeypatch):
+    assert(Pipeline().transport is MultiprocessingPipe)
+    assert(Pipeline(transport='redis').transport is RedisPipe)
+    monkeypatch.setenv('PYPELINE_TRANSPORT', 'redis')
+    assert(Pipeline().transport is RedisPipe)
+    with pytest.raises(ValueError):
+        Pipeline(transport='carrier-pigeon')
+
+
+def test_import_does_not_touch_redis():
+    code = "import sys, pypeline; print('redis' in sys.modules)"
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+
+    assert(out.stdout.strip() == 'False')
+
+
+def test_window_spill(data_timed_holes, tmp_path):
+    def run(window):
+        return [[x['value'] for x in ar] for row in data_timed_holes for ar in window.apply(row)]
+
+    expected = run(Window(timedelta(seconds=6), skip=1, key='time'))
+    window = Window(timedelta(seconds=6), skip=1, key='time', memory_budget=200, spill_dir=str(tmp_path))
+
+    assert(run(window) == expected)
+    assert(0 < len(window.memory.segments) <= 3)
+    # the newest rows stay in memory after a spill
+    assert(window.memory.rows and window.memory.size <= 200)
+    assert(window.memory.rows[-1][0] == data_timed_holes[-1]['time'])
+    window.memory.close()
+    assert(list(tmp_path.iterdir()) == [])
+
+
+def square(x):
+    return x * x
+
+
+def test_worker_pool(data_list, shared_list):
+    with WorkerPool(3) as pool:
+        for _ in range(3):
+            with Pipeline(pool=pool) as p:
+                p | IterableSource(data_list) | Map(square) | ListSink(shared_list)
+            assert(set(p.stats['components']) == {c.name for c in p.components})
+            assert(p.stats['startup'] >= 0)
+        assert(len(pool.workers) == 3)
+
+    assert(list(shared_list) == [x * x for x in data_list] * 3)
+
+
+def test_groupby_composite_key(data_timed_holes_grouped_multiple):
+    windows = [data_timed_holes_grouped_multiple[i:i + 8] for i in range(0, 24, 8)]
+    by_group, by_group2 = GroupBy('group'), GroupBy('group2')
+    stacked = [g2 for w in windows for g in by_group.apply(w) for g2 in by_group2.apply(g)]
+    composite = GroupBy(('group', 'group2'))
+
+    assert([g for w in windows for g in composite.apply(w)] == stacked)
+
+
+def test_groupby_aggregate(data_timed_holes_grouped_multiple):
+    rows = data_timed_holes_grouped_multiple
+    groupby = GroupBy(('group', 'group2'), agg={
+        'count': 'count',
+        'total': ('value', 'sum'),
+        'mean': ('value', 'mean'),
+        'first': ('value', 'min'),
+        'last': ('time', 'max'),
+        'values': ('value', lambda acc, v: acc * 100 + v),
+    })
+    result = list(groupby.apply(rows))
+
+    for out in result:
+        group = [r for r in rows if (r['group'], r['group2']) == (out['group'], out['group2'])]
+        values = [r['value'] for r in group]
+        assert(out['count'] == len(group))
+        assert(out['total'] == sum(values))
+        assert(out['mean'] == sum(values) / len(values))
+        assert(out['first'] == min(values))
+        assert(out['last'] == max(r['time'] for r in group))
+        assert(out['values'] == reduce(lambda acc, v: acc * 100 + v, values))
+    assert(sum(out['count'] for out in result) == len(rows))
+    assert(list(GroupBy(lambda r: r['value'] % 2, agg={'n': 'count'}).apply(rows))[0] == {'key': 0, 'n': 10})
+
+
+def test_distinct_count():
+    rows = [{'user': i % 5000, 'page': i % 2} for i in range(20000)]
+    count, = DistinctCount('user').apply(rows)
+    per_page, = DistinctCount('user', by='page').apply(rows)
+    left, = DistinctCount('user', sketch=True).apply(rows[:12000])
+    right, = DistinctCount('user', sketch=True).apply(rows[8000:])
+
+    assert(abs(count - 5000) < 5000 * 0.06)
+    assert(set(per_page) == {0, 1} and all(abs(n - 2500) < 2500 * 0.06 for n in per_page.values()))
+    assert(left.merge(right).count() == count)
+    assert(len(left.registers) <= 4096)
+
+
+def test_topk():
+    random.seed(42)
+    urls = ['/hot/%d' % i for i in range(5) for _ in range(1000 - 100 * i)]
+    urls += ['/cold/%d' % random.randint(0, 3000) for _ in range(5000)]
+    random.shuffle(urls)
+    top, = TopK(5, 'url').apply([{'url': u} for u in urls])
+
+    assert([u for u, _ in top] == ['/hot/%d' % i for i in range(5)])
+    assert(all(abs(n - (1000 - 100 * i)) < 100 for i, (_, n) in enumerate(top)))
+
+
+def test_quantiles():
+    values = list(range(10000))
+    random.seed(42)
+    random.shuffle(values)
+    rows = [{'latency': v} for v in values]
+    result, = Quantiles('latency', (0.5, 0.99)).apply(rows)
+    left, = Quantiles('latency', sketch=True).apply(rows[:5000])
+    right, = Quantiles('latency', sketch=True).apply(rows[5000:])
+    merged = left.merge(right)
+
+    assert(abs(result[0.5] - 5000) < 300 and abs(result[0.99] - 9900) < 300)
+    assert(abs(merged.quantile(0.5) - 5000) < 300)
+    assert(sum(map(len, merged.compactors)) < 1000)
+
+
+def test_dedup():
+    start = datetime(2018, 5, 4, 15, 45)
+    rows = [{'id': i % 10, 'time': start + timedelta(seconds=i)} for i in range(40)]
+
+    assert(list(Dedup('id').apply(rows)) == [rows[:10]])
+    dedup = Dedup('id')
+    assert([r for row in rows for r in dedup.apply(row)] == rows[:10])
+    # ids are remembered between `within` and twice `within`
+    dedup = Dedup('id', within=timedelta(seconds=15), time='time')
+    assert([r for row in rows for r in dedup.apply(row)] == rows[:10])
+    dedup = Dedup('id', within=timedelta(seconds=4), time='time')
+    assert([r for row in rows for r in dedup.apply(row)] == rows)
+    dedup = Dedup('id', within=5)
+    assert([r['id'] for row in rows for r in dedup.apply(row)] == list(range(10)) * 4)
+
+
+def test_lookup_join_hit_behind_misses():
+    def loader(keys):
+        return {k: {'name': k.upper()} for k in keys}
+
+    join = LookupJoin('k', loader, cache=LRUCache(maxsize=2), batch=3, how='inner')
+    list(join.apply({'k': 'a'}))
+    list(join.flush())
+    result = [r for k in 'xay' for r in join.apply({'k': k})]
+
+    assert(result == [{'k': k, 'name': k.upper()} for k in 'xay'])
+
+
+def test_lookup_join_table():
+    now = [0]
+    table = {k: {'name': 'device-%d' % k} for k in range(5)}
+    cache = LRUCache(maxsize=3, ttl=10, refresh_ahead=0.5, clock=lambda: now[0])
+    join = LookupJoin('k', table=lambda: table, cache=cache)
+    result = []
+    for k in range(7):
+        now[0] += 4
+        result += join.apply({'k': k})
+    result += join.flush()
+
+    assert(result == [{'k': k, **table[k]} for k in range(5)] + [{'k': 5}, {'k': 6}])
+    assert((join.hits, join.misses) == (5, 2))
+    assert(len(cache) == 0)
+
+
+def child_name(names):
+    names.append(Pipeline().name)
+
+
+def test_names_unique_in_forked_processes(shared_list):
+    children = [Process(target=child_name, args=(shared_list,)) for _ in range(2)]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+    assert(len(set(shared_list)) == 2)
+    assert(Pipeline().name not in shared_list)
+
+
+def test_worker_pool_unpicklable(data_list, shared_list):
+    with WorkerPool(3) as pool:
+        with pytest.raises((pickle.PicklingError, AttributeError)):
+            with Pipeline(pool=pool) as p:
+                p | IterableSource(data_list) | Map(lambda x: x) | ListSink(shared_list)
+        assert(len(pool.idle) == 3)
+        with Pipeline(pool=pool) as p:
+            p | IterableSource(data_list) | ListSink(shared_list)
+
+    assert(list(shared_list) == data_list)
+
+
+Point = namedtuple('Point', ['group', 'value'])
+
+
+def test_key_namedtuple_and_mixed_rows():
+    rows = [Point(1, 2), Point(0, 3), Point(1, 4)]
+
+    assert(list(GroupBy('group').apply(rows)) == [[rows[0], rows[2]], [rows[1]]])
+    assert(list(GroupBy(0).apply(rows)) == [[rows[0], rows[2]], [rows[1]]])
+    mixed = [{'group': 0, 'value': 1}, Point(0, 2), {'group': 1, 'value': 3}]
+    assert(list(GroupBy(('group',), agg={'n': 'count'}).apply(mixed)) == [{'group': 0, 'n': 2}, {'group': 1, 'n': 1}])
+    with pytest.raises(KeyError):
+        Key('missing').get_value({'group': 0})
+
+
+def test_key_subscriptable_rows():
+    connection = sqlite3.connect(':memory:')
+    connection.row_factory = sqlite3.Row
+    rows = connection.execute("select 1 as g, 2 as v union all select 0, 3 union all select 1, 4").fetchall()
+
+    assert([[r['v'] for r in g] for g in GroupBy('g').apply(rows)] == [[2, 4], [3]])
+    assert(list(GroupBy(('g',), agg={'n': 'count'}).apply(rows)) == [{'g': 1, 'n': 2}, {'g': 0, 'n': 1}])
+
+
+def test_sketch_value_types():
+    assert(list(Dedup().apply([1, '1', b'1', 1])) == [[1, '1', b'1']])
+    assert(list(DistinctCount(lambda x: x).apply([1, '1', b'1'])) == [3])
+
+
+def test_dedup_capacity():
+    rows = list(range(5000))
+    dedup = Dedup(capacity=100)
+
+    assert(len([r for row in rows for r in dedup.apply(row)]) > 4900)
+    assert(list(dedup.apply(4999)) == [])
+    assert(len(list(Dedup(capacity=100).apply(rows))[0]) > 4900)
+
+
+def test_dedup_time_gap():
+    start = datetime(2018, 5, 4, 15, 45)
+    rows = [{'id': 'a', 'time': start + timedelta(seconds=s)} for s in (0, 3, 7, 1000)]
+    dedup = Dedup('id', within=timedelta(seconds=5), time='time')
+
+    assert([r for row in rows for r in dedup.apply(row)] == [rows[0], rows[3]])
+
+
+def test_sketch_hash_canonical():
+    code = "from pypeline.sketch import hash128; print(hash128(frozenset({'alice', 'bob', 'carol'})))"
+    hashes = {
+        subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                       env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+        for seed in ('1', '2')
+    }
+
+    assert(len(hashes) == 1)
+    assert(list(Dedup().apply([{'a': 1, 'b': 2}, {'b': 2, 'a': 1}, {'a': '1', 'b': 2}])) == [
+        [{'a': 1, 'b': 2}, {'a': '1', 'b': 2}],
+    ])
+
+
+def test_dedup_merge():
+    left, right = Dedup(within=100), Dedup(within=100, sketch=True)
+    list(left.apply('a'))
+    for value in 'bc':
+        list(right.apply(value))
+    filters, = right.flush()
+    merged = Dedup(within=100, filters=left.filters).merge(filters)
+
+    assert([r for value in 'abcd' for r in merged.apply(value)] == ['d'])
+    assert(list(left.flush()) == [])
+
+
+def test_lookup_join_stats(shared_list):
+    table = {k: {'name': 'device-%d' % k} for k in range(3)}
+
+    with Pipeline() as p:
+        join = p | IterableSource([{'k': k % 5} for k in range(10)]) | LookupJoin('k', table=lambda: table)
+        join | ListSink(shared_list)
+
+    assert(p.stats['components'][join.name] == {'hits': 6, 'misses': 4})
+    assert(len(shared_list) == 10)